@@ -0,0 +1,57 @@
+from ctypes import sizeof, c_ulong
+from numpy import dtype, asarray, ascontiguousarray, argsort, searchsorted, unique, uint64, int64, float64, where
+from .DWDataReaderHeader import DWCANPortData
+
+__all__ = ['CAN_DTYPE', 'SIGNAL_DTYPE', 'decode_can_signals']
+
+CAN_DTYPE = dtype({'names': ['arb_id', 'data'],
+                   'formats': ['<u{}'.format(sizeof(c_ulong)), ('u1', (8,))],
+                   'offsets': [DWCANPortData.arb_id.offset, DWCANPortData.data.offset],
+                   'itemsize': sizeof(DWCANPortData)})
+r"""Structured numpy dtype matching the DWCANPortData structure"""
+
+SIGNAL_DTYPE = dtype([('name', 'U100'), ('arb_id', '<u4'), ('start_bit', 'u1'), ('length', 'u1'), ('scale', 'f8'),
+                      ('offset', 'f8'), ('signed', '?')])
+r"""Structured numpy dtype describing a CAN signal in a frame"""
+
+
+def decode_can_signals(frames, signals):
+    r"""
+    Extracts signals from CAN frames. The frames are grouped once by arbitration id, after which all signals of an
+    arbitration id are decoded at once for all its frames, without looping over the individual frames. Signals are
+    expected in Intel (little endian) byte order, with the start bit counted from the least significant bit of the first
+    data byte.
+
+    :param frames: A numpy array with the CAN_DTYPE, as read from a CAN port channel
+    :param signals: A sequence of (name, arb_id, start_bit, length, scale, offset, signed) tuples or an array with the
+    SIGNAL_DTYPE
+    :return: A dictionary with per signal name a tuple of the frame indices and the decoded values
+    """
+    signals = asarray(signals, dtype=SIGNAL_DTYPE)
+    if signals.size == 0:
+        return {}
+    if ((signals['length'] < 1) | (signals['length'] > 64) |
+            (signals['start_bit'].astype(int64) + signals['length'] > 64)).any():
+        raise ValueError('CAN signals should lie within the 64 bits of the frame data!')
+    payload = ascontiguousarray(frames['data']).view('<u8').ravel()
+    order = argsort(frames['arb_id'], kind='mergesort')
+    sorted_ids = frames['arb_id'][order]
+    arb_ids = unique(signals['arb_id'])
+    lower = searchsorted(sorted_ids, arb_ids, side='left')
+    upper = searchsorted(sorted_ids, arb_ids, side='right')
+
+    decoded = {}
+    for arb_id, lo, hi in zip(arb_ids, lower, upper):
+        frame_idx = order[lo:hi]
+        sigs = signals[signals['arb_id'] == arb_id]
+        # shift each signal to the top of the 64 bits and back, so the sign is extended by the arithmetic shift
+        top_shift = (64 - sigs['start_bit'].astype(uint64) - sigs['length'].astype(uint64))
+        bottom_shift = 64 - sigs['length'].astype(uint64)
+        aligned = payload[frame_idx, None] << top_shift
+        unsigned = aligned >> bottom_shift
+        signed = aligned.view(int64) >> bottom_shift.astype(int64)
+        values = where(sigs['signed'], signed.astype(float64), unsigned.astype(float64))
+        values = values * sigs['scale'] + sigs['offset']
+        for k, name in enumerate(sigs['name']):
+            decoded[str(name)] = (frame_idx, values[:, k])
+    return decoded
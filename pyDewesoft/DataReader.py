@@ -2,22 +2,101 @@ from .DWDataReaderHeader import *
 from ctypes import *
 import _ctypes
 import platform
-from pint import UnitRegistry, set_application_registry
-from pint.errors import UndefinedUnitError
-from numpy import zeros, append, where, diff, ndarray, arange, insert, nan, empty, array, linspace, histogram, \
-    max as np_max, where, in1d
+import sys
+from numpy import append, where, diff, ndarray, arange, nan, empty, array, linspace, histogram, \
+    max as np_max, where, frombuffer, dtype as np_dtype, float64, memmap, array_equal, broadcast_to, asarray, \
+    searchsorted
+from os import remove
 from os.path import dirname
+from shutil import rmtree
+from tempfile import mkdtemp
 import re
-from dill import dumps, loads, HIGHEST_PROTOCOL
+import warnings
 import zlib
 from .logger import logged
+from .CANDecoder import CAN_DTYPE
+from .OutOfCore import CHUNK_SIZE, spill, extend, insert_segments, find_gaps, dump
 
-u = UnitRegistry(autoconvert_offset_to_baseunit=True)
-set_application_registry(u)
-if hasattr(u, 'setup_matplotlib'):
-    u.setup_matplotlib()
+__all__ = ['Data', 'Reader', 'ScaledChannel', 'dewe_reader', 'get_registry', 'setup_matplotlib']
 
-__all__ = ['Data', 'Reader', 'dewe_reader']
+_registry = None
+
+
+def get_registry():
+    r"""
+    Returns the Pint unit registry used by pyDewesoft. The registry is created and set as the application registry on
+    first use, so importing pyDewesoft doesn't pay for parsing the unit definitions. Newer Pint versions load the
+    definitions from a pre-parsed cache. If matplotlib is already imported, its unit support is set up as well.
+
+    :return: The Pint UnitRegistry
+    """
+    global _registry
+    if _registry is None:
+        from pint import UnitRegistry, set_application_registry
+        try:
+            registry = UnitRegistry(autoconvert_offset_to_baseunit=True, cache_folder=':auto:')
+        except TypeError:
+            registry = UnitRegistry(autoconvert_offset_to_baseunit=True)
+        set_application_registry(registry)
+        _registry = registry
+        if 'matplotlib' in sys.modules:
+            setup_matplotlib()
+    return _registry
+
+
+def setup_matplotlib(enable=True):
+    r"""
+    Enables (or disables) plotting of Pint quantities with matplotlib. This imports matplotlib.
+
+    :param enable: True if the matplotlib unit support should be enabled
+    """
+    registry = get_registry()
+    if hasattr(registry, 'setup_matplotlib'):
+        registry.setup_matplotlib(enable)
+
+
+class _LazyRegistry:
+    r"""
+    Stand-in for the Pint UnitRegistry which forwards everything to the registry returned by get_registry()
+    """
+
+    def __getattr__(self, item):
+        return getattr(get_registry(), item)
+
+    def __getitem__(self, item):
+        return get_registry()[item]
+
+    def __call__(self, *args, **kwargs):
+        return get_registry()(*args, **kwargs)
+
+    def __contains__(self, item):
+        return item in get_registry()
+
+    def __dir__(self):
+        return dir(get_registry())
+
+
+u = _LazyRegistry()
+
+RAW_DTYPES = {
+    DWDataType.dtByte: 'u1',
+    DWDataType.dtShortInt: 'i1',
+    DWDataType.dtSmallInt: 'i2',
+    DWDataType.dtWord: 'u2',
+    DWDataType.dtInteger: 'i4',
+    DWDataType.dtSingle: 'f4',
+    DWDataType.dtInt64: 'i8',
+    DWDataType.dtDouble: 'f8',
+    DWDataType.dtLongword: 'u4',
+}
+r"""Mapping of the Dewesoft data types to the numpy dtype of their raw samples"""
+
+STRUCTURED_DTYPES = {
+    DWDataType.dtComplexSingle: np_dtype('c8'),
+    DWDataType.dtComplexDouble: np_dtype('c16'),
+    DWDataType.dtCANPortData: CAN_DTYPE,
+}
+r"""Mapping of the non scalar Dewesoft data types to the numpy dtype in which they are decoded"""
 
 
 @logged
@@ -45,23 +124,11 @@ class Time:
         return len(self._time_map)
 
     def __getitem__(self, item):
-        if item == 'main':
-            if self.main_time is None:
-                try:
-                    self._get_main_time_idx()
-                except RuntimeError:
-                    self.main_time = max(self._time, key=lambda k: len(set(self._time[k])))
-            return self._time[self.main_time] * u.s
-        else:
-            return self._time[self._time_map[item]] * u.s
+        return self.magnitude(item) * u.s
 
     def __setitem__(self, key, value):
         if key == 'main':
-            if self.main_time is None:
-                try:
-                    self._get_main_time_idx()
-                except RuntimeError:
-                    self.main_time = max(self._time, key=lambda k: len(set(self._time[k])))
+            self._set_main_time()
             self._time[self.main_time] = value
             return
         idx, contains = self._contains_time(value)
@@ -85,11 +152,7 @@ class Time:
         :param time: The time vector to append
         """
         if channel_name == 'main':
-            if self.main_time is None:
-                try:
-                    self._get_main_time_idx()
-                except RuntimeError:
-                    self.main_time = max(self._time, key=lambda k: len(set(self._time[k])))
+            self._set_main_time()
             self._time[self.main_time] = time
             return
         idx, contains = self._contains_time(time)
@@ -98,8 +161,66 @@ class Time:
         else:
             self._append_new_time(channel_name, time)
 
+    def magnitude(self, item):
+        r"""
+        Returns the time line of a channel in seconds as the stored numpy array, without units and without copying it
+
+        :param item: The channel name or 'main'
+        """
+        if item == 'main':
+            self._set_main_time()
+            return self._time[self.main_time]
+        else:
+            return self._time[self._time_map[item]]
+
+    def slice(self, t_start, t_end, channel_names=None):
+        r"""
+        Cuts the time lines to the samples with t_start <= t < t_end, using a single binary search per unique time line.
+        The time lines of the result are views on the original ones.
+
+        :param t_start: The start time in seconds
+        :param t_end: The end time in seconds, exclusive
+        :param channel_names: The channels to keep, by default all channels
+        :return: A tuple of the sliced Time object and a dictionary with the (start, stop) index per time line
+        """
+        if channel_names is None:
+            channel_names = list(self._time_map.keys())
+        sliced = Time()
+        sliced.sample_rate = self.sample_rate
+        sliced._idx = self._idx
+        ranges = {}
+        for chan_name in channel_names:
+            key = self._time_map[chan_name]
+            if key not in ranges:
+                ranges[key] = tuple(searchsorted(self._time[key], [t_start, t_end], side='left'))
+                sliced._time[key] = self._time[key][ranges[key][0]:ranges[key][1]]
+            sliced._time_map[chan_name] = key
+        if self.main_time in ranges:
+            sliced.main_time = self.main_time
+        return sliced, ranges
+
+    def overlap_length(self, channel_name, time):
+        r"""
+        Returns the number of leading samples of a new time vector which don't come after the last time stamp of the
+        channel, i.e. the samples that overlap with or go back in time from the existing time line. Only the boundary
+        time stamp is used, so the cost depends on the new time vector and not on the length of the time line.
+
+        :param channel_name: The channel name
+        :param time: The sorted time vector that will be appended
+        """
+        existing = self.magnitude(channel_name)
+        if len(existing) == 0 or len(time) == 0:
+            return 0
+        return int(searchsorted(time, existing[-1], side='right'))
+
     def filter_existing(self, channel_name, time):
-        return where(in1d(time, self[channel_name]) == False)[0]
+        r"""
+        Returns the indices of the samples of a new time vector which come after the existing time line of the channel
+
+        :param channel_name: The channel name
+        :param time: The sorted time vector that will be appended
+        """
+        return arange(self.overlap_length(channel_name, time), len(time))
 
     def clean(self):
         r"""
@@ -137,6 +258,14 @@ class Time:
         self.main_time = None
         self._idx += 1
 
+    def _set_main_time(self):
+        if self.main_time is None:
+            try:
+                self._get_main_time_idx()
+            except RuntimeError:
+                # fall back on the longest time line
+                self.main_time = max(self._time, key=lambda k: len(self._time[k]))
+
     def _get_main_time_idx(self):
         if self.sample_rate is None:
             error_msg = 'Sample rate not set!'
@@ -145,7 +274,8 @@ class Time:
         for k, t in self._time.items():
             if len(t) < 2:
                 continue
-            diff_t = diff(t)
+            # the time step is determined from the first chunk, so memory-mapped time lines aren't read completely
+            diff_t = diff(t[:CHUNK_SIZE + 1])
             hist = histogram(diff_t)
             dt = round(hist[1][where(hist[0] == np_max(hist[0]))][0], 4) * u.s
             if dt == self.dt:
@@ -182,6 +312,113 @@ class Time:
         return '', False
 
 
+@logged
+class ScaledChannel:
+    r"""
+    A channel stored as raw samples in their native Dewesoft data type. The scale and offset are kept as metadata and
+    are only applied when the engineering values are accessed, either as a whole, by index or in chunks.
+
+    :param raw: The raw samples
+    :param scale: The Dewesoft channel scale
+    :param offset: The Dewesoft channel offset
+    :param units: The Pint unit of the scaled values
+    """
+
+    def __init__(self, raw, scale=1., offset=0., units=None):
+        self.raw = raw
+        self.scale = scale
+        self.offset = offset
+        self.units = u['dimensionless'] if units is None else units
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            for value in chunk:
+                yield value
+        return
+
+    def __getitem__(self, item):
+        return self._apply(self.raw[item]) * self.units
+
+    def __array__(self, dtype=None):
+        magnitude = self.magnitude
+        return magnitude if dtype is None else magnitude.astype(dtype)
+
+    @property
+    def magnitude(self):
+        r"""
+        The scaled values as a float64 array without units
+        """
+        return self._apply(self.raw)
+
+    @property
+    def shape(self):
+        r"""
+        The shape of the raw samples
+        """
+        return self.raw.shape
+
+    @property
+    def nbytes(self):
+        r"""
+        The number of bytes used by the raw samples
+        """
+        return self.raw.nbytes
+
+    def chunks(self, chunk_size=2 ** 20):
+        r"""
+        Yields the scaled values in chunks, so the full float64 array is never allocated at once
+
+        :param chunk_size: The number of samples per chunk
+        """
+        for start in range(0, len(self.raw), chunk_size):
+            yield self[start:start + chunk_size]
+
+    def window(self, start, stop=None):
+        r"""
+        Returns a ScaledChannel on a range of the raw samples, without copying them
+
+        :param start: The first sample index
+        :param stop: The sample index after the last sample, by default the end of the channel
+        """
+        return ScaledChannel(self.raw[start:stop], self.scale, self.offset, self.units)
+
+    def to_quantity(self):
+        r"""
+        Converts the channel to a regular Pint quantity with scaled float64 values
+        """
+        return self.magnitude * self.units
+
+    def append(self, other):
+        r"""
+        Appends another channel. The raw samples are kept when the scaling is identical, otherwise the result falls back
+        to a scaled Pint quantity.
+
+        :param other: A ScaledChannel or a Pint quantity
+        :return: The appended channel
+        """
+        if not isinstance(other, ScaledChannel) and self.scale == 1. and self.offset == 0. and \
+                getattr(other.magnitude, 'dtype', None) == self.raw.dtype:
+            other = ScaledChannel(other.to(self.units).magnitude, units=self.units)
+        if isinstance(other, ScaledChannel) and other.scale == self.scale and other.offset == self.offset and \
+                other.raw.dtype == self.raw.dtype and other.units == self.units:
+            raw = extend(self.raw, other.raw) if isinstance(self.raw, memmap) else append(self.raw, other.raw, axis=0)
+            return ScaledChannel(raw, self.scale, self.offset, self.units)
+        self.logger.info('Scaling differs between appended channels, falling back to scaled values')
+        other = other.to_quantity() if isinstance(other, ScaledChannel) else other
+        return append(self.magnitude, other.to(self.units).magnitude, axis=0) * self.units
+
+    def _apply(self, raw):
+        values = raw.astype(float64)
+        if self.scale != 1.:
+            values *= self.scale
+        if self.offset != 0.:
+            values += self.offset
+        return values
+
+
 @logged
 class Data:
     r"""
@@ -218,7 +455,7 @@ class Data:
         if item in self.time:
             return self.time[item], getattr(self, item)
         else:
-            return None, array(getattr(self, item))
+            return None, asarray(getattr(self, item))
 
     def __setitem__(self, key, value):
         raise NotImplementedError
@@ -226,6 +463,37 @@ class Data:
     def __delitem__(self, key):
         raise NotImplementedError
 
+    def slice(self, t_start, t_end, channels=None):
+        r"""
+        Returns a Data object with the samples of all channels with t_start <= t < t_end. Each unique time line is
+        searched once and its index range is applied to every channel on that time line, so the channels of the result
+        are views on the original data and no samples are copied. Channels without time are kept as is.
+
+        :param t_start: The start time, in seconds or as a Pint quantity
+        :param t_end: The end time, in seconds or as a Pint quantity, exclusive
+        :param channels: The channel names to keep, by default all channels
+        :return: a Data object
+        """
+        t_start = t_start.to(u.s).magnitude if hasattr(t_start, 'to') else t_start
+        t_end = t_end.to(u.s).magnitude if hasattr(t_end, 'to') else t_end
+        if channels is None:
+            channels = self.channel_names[self.offset_channel_idx:]
+        sliced = Data()
+        sliced.time, ranges = self.time.slice(t_start, t_end, [chan for chan in channels if chan in self.time])
+        sliced.start_store_time = self.start_store_time
+        sliced.duration = t_end - t_start
+        sliced.version = self.version
+        for chan_name in channels:
+            chan = getattr(self, chan_name)
+            if chan_name in self.time:
+                start, stop = ranges[self.time._time_map[chan_name]]
+                if isinstance(chan, ScaledChannel):
+                    chan = chan.window(start, stop)
+                else:
+                    chan = chan[start:stop]
+            setattr(sliced, chan_name, chan)
+        return sliced
+
     @property
     def sample_rate(self):
         r"""
@@ -261,16 +529,27 @@ class Reader:
     in Dewesoft. If a unit for a channel/variable is specified in Dewesoft, The reader tries to exports that unit to a
     Pint unit.
 
+    When raw is set, channels with a numeric data type are stored as ScaledChannel objects containing the raw samples in
+    their native data type. The scale and offset are then applied lazily when the values are accessed. Note that
+    integer samples can't hold NAN values, so Reader.sequence_read() with correcttime converts the raw samples of
+    integer channels on the main time line to float64, which gives up the memory savings for those channels.
+
     :param filename: The file name to import
+    :param raw: True if the raw samples should be stored instead of the scaled float64 values
     """
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, raw=False):
         self.logger.info('Reader initialized')
         self.filename = filename
+        self.raw = raw
         self.platform = platform.architecture()
         self.logger.info('{} platform used'.format(self.platform))
         self.data = Data()
         self.compression_rate = 5
+        self.memory_limit = None
+        self.scratch_dir = None
+        self._temp_dir = None
+        self.overlaps = []
 
         if 'Win' not in self.platform[1]:
             raise NotImplementedError('Only the Windows operating system is supported at this stage!')
@@ -287,19 +566,44 @@ class Reader:
         if self.filename is not None:
             self.read(filename=filename)
 
-    def sequence_read(self, filenames, correcttime=False):
+    def sequence_read(self, filenames, correcttime=False, memory_limit=None, scratch_dir=None):
         r"""
         Reads a sequence of Dewesoft files and stitches them together, the results are stored in the Reader.data object
         and can be saved using the Read.save() method.
 
+        When a memory limit is given, the largest channels and time lines are spilled to memory-mapped files in the
+        scratch directory as soon as the data kept in memory exceeds the limit. These channels become memory-mapped
+        arrays, which are appended to, gap filled and saved chunk by chunk. Files which are no longer used by the
+        Reader.data object are removed right away, the remaining files and the temporary scratch directory are removed
+        by Reader.close().
+
+        Samples of a file which don't come after the last time stamp of the previous files, for instance when Dewesoft
+        restarted a recording, are dropped and their time span is subtracted from the duration. These are reported in
+        Reader.overlaps as a list of (filename, dropped) tuples, where dropped maps each channel to the number of
+        dropped samples, the first dropped time stamp and the last time stamp that was already stored. A RuntimeWarning
+        is issued when all samples of a channel are dropped, since the files are then most likely not in chronological
+        order or the time stamps restarted at zero.
+
         :param filenames: An iterable object containing the filenames
         :param correcttime: True if gaps in time be filled with NAN values at the same interval as the sampling rate and
-        existing sample in the n+m file be discarded. In other words it creates an continiuous time vector.
+        existing sample in the n+m file be discarded. In other words it creates an continiuous time vector. Integer
+        channels on the main time line are converted to floats to hold the NAN values, and a ValueError is raised if a
+        CAN port channel is on the main time line.
+        :param memory_limit: The number of bytes the channels and time lines may occupy in memory, None for no limit
+        :param scratch_dir: The directory for the memory-mapped files, by default a new temporary directory
         """
+        if memory_limit is not None:
+            self.memory_limit = memory_limit
+            if scratch_dir is not None:
+                self.scratch_dir = scratch_dir
+            elif self.scratch_dir is None:
+                self.scratch_dir = self._temp_dir = mkdtemp(prefix='pyDewesoft_')
         for fname in filenames:
             self.read(fname)
         if correcttime:
+            scratch_files = self._scratch_files()
             self._fill_gaps()
+            self._remove_scratch_files(scratch_files)
 
     def read(self, filename=None):
         r"""
@@ -308,33 +612,168 @@ class Reader:
 
         :param filename: the file name
         """
+        scratch_files = self._scratch_files()
+        self._read(filename)
+        self._remove_scratch_files(scratch_files)
+
+    def close(self):
+        r"""
+        Releases the Reader.data object and removes its memory-mapped files, together with the scratch directory when it
+        was created by the reader. Memory-mapped channels can't be used afterwards, so save the data first.
+        """
+        scratch_files = self._scratch_files()
+        self.data = Data()
+        self._remove_scratch_files(scratch_files)
+        if self._temp_dir is not None:
+            rmtree(self._temp_dir, ignore_errors=True)
+            self.logger.info('Removed scratch directory {}'.format(self._temp_dir))
+            self.scratch_dir = self._temp_dir = None
+
+    def _read(self, filename):
         finfo = self._open_file(filename)
+        filename = self.filename if filename is None else filename
         self._get_file_info(finfo)
         num = self._get_nof_channels()
         ch_list = self._get_channel_list(num)
         # get the data
 
+        extended_time = {}
+        dropped = {}
+        restarted = []
         for i in range(0, num):
             attr = self._get_channel_name(ch_list, i)
             unit = self._get_unit(ch_list, i)
             time, data = self._get_data(ch_list, i, unit)
             desc = self._get_channel_desc(ch_list, i, attr, data)
             if hasattr(self.data, attr):
+                time, data = self._trim_overlap(attr, time, data, dropped, restarted)
                 prev_data = getattr(self.data, attr)
-                setattr(self.data, attr, append(prev_data, data))
-                prev_time = self.data.time[attr]
-                self.data.time.append(attr, append(prev_time, time))
+                if isinstance(prev_data, ScaledChannel):
+                    setattr(self.data, attr, prev_data.append(data))
+                elif isinstance(data, ScaledChannel):
+                    data = data.to_quantity().to(prev_data.units)
+                    setattr(self.data, attr, append(prev_data.magnitude, data.magnitude, axis=0) * prev_data.units)
+                elif isinstance(self._get_storage(prev_data), memmap):
+                    if hasattr(prev_data, 'units') and hasattr(data, 'to'):
+                        data = data.to(prev_data.units)
+                    storage = extend(self._get_storage(prev_data), getattr(data, 'magnitude', data))
+                    self._set_storage(attr, prev_data, storage)
+                else:
+                    setattr(self.data, attr, append(prev_data, data, axis=0))
+                self.data.time.append(attr, self._append_time(extended_time, attr, time))
                 self.logger.info('Imported and appended {}'.format(attr))
             else:
                 setattr(self.data, attr, data)
-                setattr(getattr(self.data, attr), '__doc__', desc)
+                try:
+                    setattr(data, '__doc__', desc)
+                except AttributeError:
+                    # numpy arrays, as used for CAN, text and binary channels, have a read-only __doc__
+                    self.logger.debug('Could not set the description of {}'.format(attr))
                 self.data.time[attr] = time
                 self.logger.info('Imported {}'.format(attr))
 
         self.data.time.clean()
+        if dropped:
+            self.overlaps.append((filename, dropped))
+            self.logger.warning('Dropped overlapping samples of {} channels in {}: {}'.format(len(dropped), filename,
+                                                                                             dropped))
+            self._subtract_dropped_duration(finfo, dropped, restarted)
+        if restarted:
+            warn_msg = ('All samples of {} in {} lie before the end of the previous files and were dropped, are the '
+                        'files in chronological order or did the recording restart at zero?').format(
+                ', '.join(restarted), filename)
+            self.logger.warning(warn_msg)
+            warnings.warn(warn_msg, RuntimeWarning)
+        if self.memory_limit is not None:
+            self._spill()
         # close the data file
         self._close_dewefile()
 
+    def _trim_overlap(self, attr, time, data, dropped, restarted):
+        # samples at or before the last stored time stamp are already stored or belong to a restarted recording
+        cnt = self.data.time.overlap_length(attr, time)
+        if cnt == 0:
+            return time, data
+        dropped[attr] = (cnt, time[0], self.data.time.magnitude(attr)[-1])
+        if cnt == len(time):
+            restarted.append(attr)
+        if isinstance(data, ScaledChannel):
+            return time[cnt:], data.window(cnt)
+        return time[cnt:], data[cnt:]
+
+    def _subtract_dropped_duration(self, finfo, dropped, restarted):
+        # the dropped time span was already counted in the duration of the previous files
+        if restarted:
+            span = finfo.duration
+        else:
+            span = min(finfo.duration, max(last - first for _, first, last in dropped.values()) +
+                       1 / self.data.sample_rate)
+        self.data.duration -= span
+
+    def _append_time(self, extended_time, attr, time):
+        # channels sharing a time line usually get the same new time stamps, so each time line is only extended once
+        prev_time = self.data.time.magnitude(attr)
+        for new_time, merged in extended_time.get(id(prev_time), []):
+            if array_equal(new_time, time):
+                return merged
+        merged = extend(prev_time, time) if isinstance(prev_time, memmap) else append(prev_time, time)
+        extended_time.setdefault(id(prev_time), []).append((time, merged))
+        return merged
+
+    def _get_storage(self, chan):
+        # the numpy array holding the samples of a channel
+        if isinstance(chan, ScaledChannel):
+            return chan.raw
+        return getattr(chan, 'magnitude', chan)
+
+    def _set_storage(self, chan_name, chan, storage):
+        # replaces the numpy array holding the samples of a channel, keeping its type and units
+        if isinstance(chan, ScaledChannel):
+            chan.raw = storage
+        elif isinstance(chan, ndarray):
+            setattr(self.data, chan_name, storage)
+        else:
+            quantity = u.Quantity(storage, chan.units)
+            quantity.__doc__ = chan.__doc__
+            setattr(self.data, chan_name, quantity)
+
+    def _scratch_files(self):
+        # the files of the memory-mapped channels and time lines in the Reader.data object
+        storages = [self._get_storage(getattr(self.data, chan_name))
+                    for chan_name in self.data.channel_names[self.data.offset_channel_idx:]]
+        storages.extend(self.data.time._time.values())
+        return {storage.filename for storage in storages if isinstance(storage, memmap) and storage.filename}
+
+    def _remove_scratch_files(self, scratch_files):
+        # removes the files which were replaced, for instance by a copy holding the appended or gap filled samples
+        for filename in scratch_files - self._scratch_files():
+            try:
+                remove(filename)
+                self.logger.debug('Removed scratch file {}'.format(filename))
+            except OSError as e:
+                self.logger.warning('Could not remove scratch file {}: {}'.format(filename, e))
+
+    def _spill(self):
+        candidates = []
+        for chan_name in self.data.channel_names[self.data.offset_channel_idx:]:
+            storage = self._get_storage(getattr(self.data, chan_name))
+            if isinstance(storage, ndarray) and not isinstance(storage, memmap) and storage.dtype.kind != 'O':
+                candidates.append((storage.nbytes, chan_name, storage))
+        for key, time in self.data.time._time.items():
+            if not isinstance(time, memmap):
+                candidates.append((time.nbytes, key, time))
+        in_memory = sum(candidate[0] for candidate in candidates)
+        for nbytes, name, storage in sorted(candidates, key=lambda candidate: candidate[0], reverse=True):
+            if in_memory <= self.memory_limit or nbytes == 0:
+                break
+            spilled = spill(storage, self.scratch_dir, str(name))
+            if isinstance(name, str):
+                self._set_storage(name, getattr(self.data, name), spilled)
+            else:
+                self.data.time._time[name] = spilled
+            in_memory -= nbytes
+            self.logger.info('Spilled {} to {}'.format(name, spilled.filename))
+
     def _open_file(self, filename):
         if filename is None:
             if self.filename is None:
@@ -377,26 +816,35 @@ class Reader:
         self.logger.info('Closing Dewefile')
 
     def _fill_gaps(self):
-        diff_t = diff(self.data.time['main']) - 1.5 / self.data.sample_rate
-        idx = where(diff_t > 0)[0]
-        self.logger.debug(r'The following indexes found {}'.format(idx))
-        for gap in idx:
-            start_time = self.data.time['main'][gap]
-            end_time = self.data.time['main'][gap + 1]
-            fill_time = arange(start_time.m, end_time.m, self.data.time.dt.m) * u.s
-            self.logger.debug(r'Filling time: {}'.format(fill_time))
-            for chan_name in self.data.channel_names[self.data.offset_channel_idx:]:
-                chan = getattr(self.data, chan_name)
-                if isinstance(chan, ndarray) and len(chan) == len(self.data.time['main']):
-                    try:
-                        shape = (len(fill_time), chan.shape[1])
-                    except IndexError:
-                        shape = fill_time.shape
-
-                    nan_data = empty(shape)
-                    nan_data[:] = nan
-                    setattr(self.data, chan_name, insert(chan, gap + 1, nan_data))
-            self.data.time['main'] = insert(self.data.time['main'].m, gap + 1, fill_time.m)
+        main_time = self.data.time.magnitude('main')
+        gaps = find_gaps(main_time, 1.5 / self.data.sample_rate)
+        self.logger.debug(r'The following indexes found {}'.format(gaps))
+        if len(gaps) == 0:
+            return
+        main_channels = [chan_name for chan_name in self.data.channel_names[self.data.offset_channel_idx:]
+                         if self.data.time._time_map.get(chan_name) == self.data.time.main_time]
+        for chan_name in main_channels:
+            storage = self._get_storage(getattr(self.data, chan_name))
+            if not isinstance(storage, ndarray) or storage.dtype.names is not None:
+                error_msg = ('Cannot fill the time gaps of {} with NAN values, read the files with correcttime=False'
+                             ).format(chan_name)
+                self.logger.error(error_msg)
+                raise ValueError(error_msg)
+        fill_times = [arange(main_time[gap], main_time[gap + 1], self.data.time.dt.m) for gap in gaps]
+        self.logger.debug(r'Filling time: {}'.format(fill_times))
+        positions = gaps + 1
+        for chan_name in main_channels:
+            chan = getattr(self.data, chan_name)
+            storage = self._get_storage(chan)
+            # integer samples can't hold NAN, so these channels are converted to floats while filling
+            dtype = storage.dtype if storage.dtype.kind in 'fcO' else float64
+            if dtype != storage.dtype:
+                self.logger.info('Converting {} from {} to {} to fill the time gaps'.format(chan_name, storage.dtype,
+                                                                                          dtype))
+            nan_data = [broadcast_to(nan, (len(fill_time),) + storage.shape[1:]) for fill_time in fill_times]
+            filled = insert_segments(storage, positions, nan_data, self.scratch_dir, chan_name, dtype=dtype)
+            self._set_storage(chan_name, chan, filled)
+        self.data.time['main'] = insert_segments(main_time, positions, fill_times, self.scratch_dir, 'time')
 
     def _get_channel_name(self, ch_list, i):
         attr = str(ch_list[i].name)[2:-1]
@@ -407,11 +855,27 @@ class Reader:
         dw_desc = 'states: \"{}\"'.format(str(ch_list[i].description)[2:-1])
         if len(dw_desc[10:]) == 0:
             dw_desc = 'is empty'
+        if ch_list[i].array_size > 1:
+            axes = ', '.join('{} [{}] of size {}'.format(str(info.name)[2:-1], str(info.unit)[2:-1], info.size)
+                             for info in self._get_array_info(ch_list, i))
+            dw_desc += '. The array axes are: {}'.format(axes)
+        data_type = type(data) if isinstance(data, ScaledChannel) else type(getattr(data, 'magnitude', data))
         desc = ('{} is an imported Dewesoft channel consisting of an {} with a {} unit. The channel description {}'
-                ).format(attr[3:], type(data.magnitude), str(data.units), dw_desc)
+                ).format(attr[3:], data_type, str(getattr(data, 'units', 'no')), dw_desc)
         return desc
 
+    def _get_array_info(self, ch_list, i):
+        dw_ch_index = self._get_channel_index(ch_list, i)
+        num = self._lib.DWGetArrayInfoCount(dw_ch_index)
+        if num == -1:
+            raise RuntimeError('Could not obtain number of array axes!')
+        info_list = (DWArrayInfo * num)()
+        if self._lib.DWGetArrayInfoList(dw_ch_index, byref(info_list)) != DWStatus.DWSTAT_OK.value:
+            raise RuntimeError('Could not obtain the array axes!')
+        return info_list
+
     def _get_unit(self, ch_list, i):
+        from pint.errors import UndefinedUnitError
         unitstr = str(ch_list[i].unit)[2:-1]
         unitstr = re.sub(r'\[|\]|\%', '', unitstr)
         try:
@@ -440,6 +904,28 @@ class Reader:
             raise RuntimeError('Could not obtain channel data type!')
         return DWDataType(cast(p_buff, POINTER(c_int)).contents.value)
 
+    def _get_channel_data_type_len(self, i):
+        idx = c_int(i)
+        max_len = c_int(INT_SIZE)
+        buff = create_string_buffer(max_len.value)
+        p_buff = cast(buff, POINTER(c_void_p))
+        if self._lib.DWGetChannelProps(idx, c_int(DWChannelProps.DW_DATA_TYPE_LEN_BYTES.value), p_buff,
+                                       byref(max_len)) != DWStatus.DWSTAT_OK.value:
+            raise RuntimeError('Could not obtain channel data type length!')
+        return cast(p_buff, POINTER(c_int)).contents.value
+
+    def _get_channel_scaling(self, i):
+        idx = c_int(i)
+        scaling = []
+        for prop in (DWChannelProps.DW_CH_SCALE, DWChannelProps.DW_CH_OFFSET):
+            max_len = c_int(DOUBLE_SIZE)
+            buff = create_string_buffer(max_len.value)
+            p_buff = cast(buff, POINTER(c_void_p))
+            if self._lib.DWGetChannelProps(idx, c_int(prop.value), p_buff, byref(max_len)) != DWStatus.DWSTAT_OK.value:
+                raise RuntimeError('Could not obtain channel scaling!')
+            scaling.append(cast(p_buff, POINTER(c_double)).contents.value)
+        return tuple(scaling)
+
     def _get_no_samples(self, ch_list, i):
         dw_ch_index = self._get_channel_index(ch_list, i)
         sample_cnt = c_int()
@@ -454,38 +940,119 @@ class Reader:
     def _get_data(self, ch_list, i, unit):
         ch_type = self._get_channel_type(i)
         ch_data_type = self._get_channel_data_type(i)
+        if self.raw and ch_data_type in RAW_DTYPES:
+            return self._get_raw_data(ch_list, i, unit, ch_data_type)
+        if ch_data_type in STRUCTURED_DTYPES:
+            return self._get_structured_data(ch_list, i, unit, ch_data_type)
+        if ch_data_type in (DWDataType.dtText, DWDataType.dtBinary):
+            return self._get_binary_data(ch_list, i, ch_data_type)
         sample_cnt = self._get_no_samples(ch_list, i)
         dw_ch_index = self._get_channel_index(ch_list, i)
-        data = create_string_buffer(DOUBLE_SIZE * sample_cnt * ch_list[i].array_size)
+        array_size = ch_list[i].array_size
+        data = create_string_buffer(DOUBLE_SIZE * sample_cnt * array_size)
         time_stamp = create_string_buffer(DOUBLE_SIZE * sample_cnt)
         p_data = cast(data, POINTER(c_double))
         p_time_stamp = cast(time_stamp, POINTER(c_double))
         if self._lib.DWGetScaledSamples(dw_ch_index, c_int64(0), sample_cnt, p_data,
                                         p_time_stamp) != DWStatus.DWSTAT_OK.value:
             raise RuntimeError('Could not obtain channel data')
-        data_array = zeros((sample_cnt,))
-        time_array = zeros((sample_cnt,))
+        data_array = frombuffer(data, dtype=float64, count=sample_cnt * array_size).copy()
+        if array_size > 1:
+            data_array = data_array.reshape((sample_cnt, array_size))
+        time_array = frombuffer(time_stamp, dtype=float64, count=sample_cnt).copy()
+        data_array = data_array * unit
+        return time_array, data_array
+
+    def _get_structured_data(self, ch_list, i, unit, ch_data_type):
+        struct_dtype = STRUCTURED_DTYPES[ch_data_type]
+        dw_ch_index = self._get_channel_index(ch_list, i)
+        sample_cnt = self._lib.DWGetRawSamplesCount(dw_ch_index)
+        if sample_cnt < 0:
+            raise RuntimeError('Could not obtain channel raw sample count!')
+        array_size = ch_list[i].array_size
+        data = create_string_buffer(struct_dtype.itemsize * sample_cnt * array_size)
+        time_stamp = create_string_buffer(DOUBLE_SIZE * sample_cnt)
+        if self._lib.DWGetRawSamples(dw_ch_index, c_int64(0), sample_cnt, cast(data, c_void_p),
+                                     cast(time_stamp, POINTER(c_double))) != DWStatus.DWSTAT_OK.value:
+            raise RuntimeError('Could not obtain channel raw data')
+        data_array = frombuffer(data, dtype=struct_dtype, count=sample_cnt * array_size).copy()
+        if array_size > 1:
+            data_array = data_array.reshape((sample_cnt, array_size))
+        time_array = frombuffer(time_stamp, dtype=float64, count=sample_cnt).copy()
+        if ch_data_type == DWDataType.dtCANPortData:
+            return time_array, data_array
+        scale, offset = self._get_channel_scaling(i)
+        if scale != 1. or offset != 0.:
+            data_array = data_array * scale + offset
+        return time_array, data_array * unit
+
+    def _get_binary_data(self, ch_list, i, ch_data_type):
+        dw_ch_index = self._get_channel_index(ch_list, i)
+        sample_cnt = self._lib.DWGetBinarySamplesCount(dw_ch_index)
+        if sample_cnt < 0:
+            raise RuntimeError('Could not obtain channel binary sample count!')
+        max_sample_len = self._get_channel_data_type_len(i)
+        data = create_string_buffer((INT_SIZE + max_sample_len) * sample_cnt)
+        time_stamp = create_string_buffer(DOUBLE_SIZE * sample_cnt)
+        data_len = c_int()
+        if self._lib.DWGetBinarySamplesEx(dw_ch_index, c_int64(0), c_int(sample_cnt), data,
+                                          cast(time_stamp, POINTER(c_double)),
+                                          byref(data_len)) != DWStatus.DWSTAT_OK.value:
+            raise RuntimeError('Could not obtain channel binary data')
+        if not 0 <= data_len.value <= len(data):
+            # the samples are longer than the data type length reported by Dewesoft, so the buffer was too small
+            raise RuntimeError('Channel binary data of {} bytes exceeds the buffer of {} bytes'.format(data_len.value,
+                                                                                                     len(data)))
+        # every sample is stored as its length followed by its bytes, so the records can only be walked sequentially
+        buff = data.raw[:data_len.value]
+        data_array = empty((sample_cnt,), dtype=object)
+        pos = 0
         for j in range(0, sample_cnt):
-            time_array[j] = p_time_stamp[j]
-            data_array[j] = p_data[j]
-        data_array *= unit
+            sample_len = int.from_bytes(buff[pos:pos + INT_SIZE], 'little', signed=True)
+            pos += INT_SIZE
+            data_array[j] = buff[pos:pos + sample_len]
+            pos += sample_len
+        if ch_data_type == DWDataType.dtText:
+            data_array = array([sample.decode(errors='replace') for sample in data_array], dtype=object)
+        time_array = frombuffer(time_stamp, dtype=float64, count=sample_cnt).copy()
         return time_array, data_array
 
+    def _get_raw_data(self, ch_list, i, unit, ch_data_type):
+        raw_dtype = np_dtype(RAW_DTYPES[ch_data_type])
+        scale, offset = self._get_channel_scaling(i)
+        dw_ch_index = self._get_channel_index(ch_list, i)
+        sample_cnt = self._lib.DWGetRawSamplesCount(dw_ch_index)
+        if sample_cnt < 0:
+            raise RuntimeError('Could not obtain channel raw sample count!')
+        array_size = ch_list[i].array_size
+        data = create_string_buffer(raw_dtype.itemsize * sample_cnt * array_size)
+        time_stamp = create_string_buffer(DOUBLE_SIZE * sample_cnt)
+        if self._lib.DWGetRawSamples(dw_ch_index, c_int64(0), sample_cnt, cast(data, c_void_p),
+                                     cast(time_stamp, POINTER(c_double))) != DWStatus.DWSTAT_OK.value:
+            raise RuntimeError('Could not obtain channel raw data')
+        raw_array = frombuffer(data, dtype=raw_dtype, count=sample_cnt * array_size).copy()
+        if array_size > 1:
+            raw_array = raw_array.reshape((sample_cnt, array_size))
+        time_array = frombuffer(time_stamp, dtype=float64, count=sample_cnt).copy()
+        return time_array, ScaledChannel(raw_array, scale, offset, unit)
+
     def __del__(self):
         if self._lib.DWDeInit() != DWStatus.DWSTAT_OK.value:
             raise RuntimeError('Could not deconstruct the DWDataReaderLib!')
 
     def save(self, filename: str):
         r"""
-        Saves the Reader.data object to a file, using a compression algorithm and dill serialization
+        Saves the Reader.data object to a file, using a compression algorithm and dill serialization. The data is
+        compressed while it is serialized, so memory-mapped channels are written chunk by chunk.
 
         :param filename: the filename, if no extension is given .pyDW is used.
         """
         if '.' not in filename:
             filename += '.pyDW'
+        from dill import HIGHEST_PROTOCOL
         self.logger.info('Saving file {}'.format(filename))
         with open(filename, 'wb') as handle:
-            handle.write(zlib.compress(dumps(self.data, protocol=HIGHEST_PROTOCOL), level=self.compression_rate))
+            dump(self.data, handle, self.compression_rate, HIGHEST_PROTOCOL)
         self.logger.info('Saved file {}'.format(filename))
 
     def load(self, filename):
@@ -497,6 +1064,8 @@ class Reader:
         """
         if '.' not in filename:
             filename += '.pyDW'
+        from dill import loads
+        get_registry()
         self.logger.info('Loading file {}'.format(filename))
         with open(filename, 'rb') as handle:
             data: Data = loads(zlib.decompress(handle.read()))
@@ -521,6 +1090,6 @@ class Reader:
             raise ValueError
 
 
-def dewe_reader(filename):
-    reader = Reader(filename)
+def dewe_reader(filename, raw=False):
+    reader = Reader(filename, raw=raw)
     return reader.data
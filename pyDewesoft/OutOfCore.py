@@ -0,0 +1,176 @@
+from os import close
+from os.path import getsize, dirname
+from tempfile import mkstemp
+from zlib import compressobj
+from numpy import memmap, asarray, ascontiguousarray, concatenate as np_concatenate, insert as np_insert, repeat, \
+    diff, where, zeros
+
+__all__ = ['CHUNK_SIZE', 'spill', 'extend', 'concatenate', 'insert_segments', 'find_gaps', 'CompressedWriter', 'dump']
+
+CHUNK_SIZE = 2 ** 20
+r"""Number of samples processed at once when working on memory-mapped arrays"""
+
+
+def _new_file(directory, name):
+    handle, filename = mkstemp(prefix=name + '_', suffix='.dat', dir=directory)
+    close(handle)
+    return filename
+
+
+def _open(filename, dtype, shape):
+    return memmap(filename, dtype=dtype, mode='r+', shape=shape)
+
+
+def _owns_file(array):
+    return isinstance(array, memmap) and array.filename is not None and getsize(array.filename) == array.nbytes
+
+
+def spill(array, directory, name='array'):
+    r"""
+    Writes an array to a file in the scratch directory and returns it as a memory-mapped array
+
+    :param array: The array to spill
+    :param directory: The scratch directory
+    :param name: Prefix of the file name
+    :return: The memory-mapped array
+    """
+    filename = _new_file(directory, name)
+    with open(filename, 'wb') as handle:
+        for start in range(0, len(array), CHUNK_SIZE):
+            ascontiguousarray(array[start:start + CHUNK_SIZE]).tofile(handle)
+    return _open(filename, array.dtype, array.shape)
+
+
+def extend(array, values):
+    r"""
+    Appends values to a memory-mapped array by writing them to the end of its file, without reading the existing
+    samples. If the array doesn't cover its whole file, for instance when it is a view, the samples are copied to a new
+    file instead.
+
+    :param array: The memory-mapped array
+    :param values: The values to append
+    :return: The memory-mapped array covering the appended file
+    """
+    if not _owns_file(array):
+        return concatenate(array, values, dirname(array.filename))
+    values = ascontiguousarray(values, dtype=array.dtype)
+    if len(values) == 0:
+        return array
+    array.flush()
+    with open(array.filename, 'ab') as handle:
+        values.tofile(handle)
+    return _open(array.filename, array.dtype, (len(array) + len(values),) + array.shape[1:])
+
+
+def concatenate(array, values, directory, name='array'):
+    r"""
+    Concatenates an array and values into a new memory-mapped file, copying the array chunk by chunk
+
+    :param array: The (memory-mapped) array
+    :param values: The values to append
+    :param directory: The scratch directory
+    :param name: Prefix of the file name
+    :return: The memory-mapped array
+    """
+    filename = _new_file(directory, name)
+    values = ascontiguousarray(values, dtype=array.dtype)
+    with open(filename, 'wb') as handle:
+        for start in range(0, len(array), CHUNK_SIZE):
+            ascontiguousarray(array[start:start + CHUNK_SIZE]).tofile(handle)
+        values.tofile(handle)
+    return _open(filename, array.dtype, (len(array) + len(values),) + array.shape[1:])
+
+
+def insert_segments(array, positions, segments, directory=None, name='array', dtype=None):
+    r"""
+    Inserts each segment before the matching position of the array, in a single pass. In-memory arrays are handled by
+    numpy, memory-mapped arrays are written chunk by chunk to a new file in the scratch directory.
+
+    :param array: The (memory-mapped) array
+    :param positions: Ascending positions in the original array
+    :param segments: The arrays to insert, one for each position
+    :param directory: The scratch directory, by default the directory of the memory-mapped array
+    :param name: Prefix of the file name
+    :param dtype: The data type of the result, by default the data type of the array
+    :return: The array with the inserted segments
+    """
+    dtype = array.dtype if dtype is None else dtype
+    if len(positions) == 0:
+        return array.astype(dtype, copy=False)
+    if not isinstance(array, memmap):
+        counts = [len(segment) for segment in segments]
+        return np_insert(array.astype(dtype, copy=False), repeat(positions, counts), np_concatenate(segments), axis=0)
+    filename = _new_file(dirname(array.filename) if directory is None else directory, name)
+    with open(filename, 'wb') as handle:
+        start = 0
+        for stop, segment in zip(list(positions) + [len(array)], list(segments) + [array[:0]]):
+            for part in (array[start:stop], segment):
+                for chunk in range(0, len(part), CHUNK_SIZE):
+                    ascontiguousarray(part[chunk:chunk + CHUNK_SIZE], dtype=dtype).tofile(handle)
+            start = stop
+    length = len(array) + sum(len(segment) for segment in segments)
+    return _open(filename, dtype, (length,) + array.shape[1:])
+
+
+def find_gaps(time, max_dt):
+    r"""
+    Finds the indices after which the time step exceeds max_dt, processing the time line chunk by chunk
+
+    :param time: The time line
+    :param max_dt: The largest time step which isn't a gap
+    :return: The ascending indices of the samples before the gaps
+    """
+    gaps = []
+    for start in range(0, max(len(time) - 1, 0), CHUNK_SIZE):
+        chunk = time[start:start + CHUNK_SIZE + 1]
+        gaps.append(where(diff(chunk) - max_dt > 0)[0] + start)
+    return np_concatenate(gaps) if gaps else zeros((0,), dtype=int)
+
+
+class CompressedWriter:
+    r"""
+    File-like object that compresses everything written to it chunk by chunk into a zlib stream, so large
+    (memory-mapped) arrays can be pickled to disk without holding a compressed copy in memory
+
+    :param handle: The binary file handle to write to
+    :param level: The zlib compression level
+    """
+
+    def __init__(self, handle, level):
+        self._handle = handle
+        self._compressor = compressobj(level)
+
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        for start in range(0, len(view), CHUNK_SIZE):
+            self._handle.write(self._compressor.compress(view[start:start + CHUNK_SIZE]))
+        return len(view)
+
+    def close(self):
+        r"""
+        Flushes the remaining compressed data to the file
+        """
+        self._handle.write(self._compressor.flush())
+
+
+def dump(obj, handle, level, protocol):
+    r"""
+    Serializes an object with dill into a zlib compressed file. Memory-mapped arrays are stored as regular arrays, which
+    are read and compressed chunk by chunk when the protocol supports out-of-band buffers.
+
+    :param obj: The object to serialize
+    :param handle: The binary file handle to write to
+    :param level: The zlib compression level
+    :param protocol: The pickle protocol
+    """
+    from dill import Pickler
+
+    class MemmapPickler(Pickler):
+        def reducer_override(self, value):
+            if isinstance(value, memmap):
+                return asarray(value).__reduce_ex__(self.proto)
+            return NotImplemented
+
+    writer = CompressedWriter(handle, level)
+    MemmapPickler(writer, protocol=protocol).dump(obj)
+    writer.close()
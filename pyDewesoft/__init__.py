@@ -1,2 +1,3 @@
-from .DataReader import Reader, u, Data, Time, dewe_reader
+from .DataReader import Reader, u, Data, Time, ScaledChannel, dewe_reader, get_registry, setup_matplotlib
 from .logger import setup_logging
+from .CANDecoder import CAN_DTYPE, SIGNAL_DTYPE, decode_can_signals
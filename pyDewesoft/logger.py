@@ -1,7 +1,6 @@
 import logging
 import logging.config
 import os
-import yaml
 
 __all__ = ['setup_logging', 'logged']
 
@@ -25,6 +24,7 @@ def setup_logging(default_path: str = 'logging.yaml', default_level: int = loggi
     if value:
         path = value
     if os.path.exists(path):
+        import yaml
         with open(path, 'rt') as f:
             config = yaml.safe_load(f.read())
         logging.config.dictConfig(config)
@@ -0,0 +1,32 @@
+from unittest import TestCase
+from pyDewesoft.CANDecoder import CAN_DTYPE, decode_can_signals
+import numpy as np
+
+
+class TestCANDecoder(TestCase):
+    def setUp(self):
+        self.frames = np.zeros((4,), dtype=CAN_DTYPE)
+        self.frames['arb_id'] = [0x100, 0x200, 0x100, 0x300]
+        self.frames['data'][0, :2] = [0x34, 0x12]
+        self.frames['data'][2, :2] = [0xFF, 0xFF]
+        self.frames['data'][1, 7] = 0x80
+        self.frames['data'][:, 2] = 0x0A
+
+    def test_unsigned_and_scaled(self):
+        decoded = decode_can_signals(self.frames, [('word', 0x100, 0, 16, 1., 0., False),
+                                                   ('nibble', 0x100, 16, 4, 0.5, 1., False)])
+        np.testing.assert_array_equal(decoded['word'][0], [0, 2])
+        np.testing.assert_array_equal(decoded['word'][1], [0x1234, 0xFFFF])
+        np.testing.assert_array_equal(decoded['nibble'][1], [6., 6.])
+
+    def test_signed(self):
+        decoded = decode_can_signals(self.frames, [('word', 0x100, 0, 16, 1., 0., True),
+                                                   ('full', 0x200, 0, 64, 1., 0., True),
+                                                   ('missing', 0x400, 0, 8, 1., 0., False)])
+        np.testing.assert_array_equal(decoded['word'][1], [0x1234, -1])
+        self.assertLess(decoded['full'][1][0], 0)
+        self.assertEqual(len(decoded['missing'][0]), 0)
+
+    def test_invalid_signal(self):
+        with self.assertRaises(ValueError):
+            decode_can_signals(self.frames, [('overflow', 0x100, 60, 8, 1., 0., False)])
@@ -0,0 +1,29 @@
+from unittest import TestCase
+from os.path import dirname, abspath
+import subprocess
+import sys
+
+base_dir = abspath(dirname(__file__) + r'/..')
+
+import_script = r'''
+import sys
+import time
+import numpy
+start = time.perf_counter()
+import pyDewesoft
+print(time.perf_counter() - start)
+print(','.join(m for m in ('pint', 'dill', 'yaml', 'matplotlib') if m in sys.modules))
+'''
+
+
+class TestImport(TestCase):
+    def test_import_is_lazy(self):
+        output = subprocess.check_output([sys.executable, '-c', import_script], cwd=base_dir,
+                                         universal_newlines=True).splitlines()
+        self.assertEqual(output[1], '')
+        self.assertLess(float(output[0]), 0.25)
+
+    def test_registry_on_first_use(self):
+        from pyDewesoft import u, get_registry
+        self.assertIs((1 * u.s)._REGISTRY, get_registry())
+        self.assertEqual(u['dimensionless'], get_registry()['dimensionless'])
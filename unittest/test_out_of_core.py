@@ -0,0 +1,50 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from io import BytesIO
+from pyDewesoft.OutOfCore import spill, extend, insert_segments, find_gaps, dump
+import numpy as np
+import zlib
+import pickle
+
+
+class TestOutOfCore(TestCase):
+    def setUp(self):
+        self.scratch = TemporaryDirectory()
+
+    def tearDown(self):
+        self.scratch.cleanup()
+
+    def test_spill_and_extend(self):
+        values = np.arange(10, dtype=np.float64)
+        spilled = spill(values, self.scratch.name, 'ch')
+        self.assertIsInstance(spilled, np.memmap)
+        np.testing.assert_array_equal(spilled, values)
+        extended = extend(spilled, [10., 11.])
+        self.assertEqual(extended.filename, spilled.filename)
+        np.testing.assert_array_equal(extended, np.arange(12))
+        # spilled no longer covers the whole file, so extending it must not append after 11.
+        diverged = extend(spilled, [20.])
+        self.assertNotEqual(diverged.filename, spilled.filename)
+        np.testing.assert_array_equal(diverged, np.append(values, 20.))
+
+    def test_insert_segments(self):
+        values = np.arange(6, dtype=np.float64).reshape((3, 2))
+        segments = [np.full((2, 2), np.nan), np.full((1, 2), -1.)]
+        expected = insert_segments(values, [1, 3], segments)
+        np.testing.assert_array_equal(expected, [[0, 1], [np.nan, np.nan], [np.nan, np.nan], [2, 3], [4, 5], [-1, -1]])
+        filled = insert_segments(spill(values, self.scratch.name), [1, 3], segments)
+        self.assertIsInstance(filled, np.memmap)
+        np.testing.assert_array_equal(filled, expected)
+
+    def test_find_gaps(self):
+        time = np.append(np.arange(0., 1., 0.1), np.arange(2., 3., 0.1))
+        np.testing.assert_array_equal(find_gaps(time, 0.15), [9])
+        self.assertEqual(len(find_gaps(time[:1], 0.15)), 0)
+
+    def test_dump(self):
+        values = np.arange(1000, dtype=np.float64)
+        handle = BytesIO()
+        dump({'ch': spill(values, self.scratch.name)}, handle, 5, pickle.HIGHEST_PROTOCOL)
+        loaded = pickle.loads(zlib.decompress(handle.getvalue()))
+        self.assertNotIsInstance(loaded['ch'], np.memmap)
+        np.testing.assert_array_equal(loaded['ch'], values)
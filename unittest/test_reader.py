@@ -1,6 +1,11 @@
 from unittest import TestCase
-from pyDewesoft.DataReader import Reader
+from unittest.mock import patch
+from ctypes import POINTER, c_int, c_double, cast, memmove
+from pyDewesoft.DataReader import Reader, ScaledChannel, Data, Time, u
+from pyDewesoft.DWDataReaderHeader import DWChannelProps, DWDataType
+from pyDewesoft.CANDecoder import CAN_DTYPE
 from os.path import dirname
+from tempfile import TemporaryDirectory
 import numpy as np
 from os import listdir, remove, path
 import logging
@@ -13,6 +18,110 @@ logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s [
 base_test_dir = dirname(__file__) + r'/../pyDewesoft/resources/testdata/'
 
 
+class StubLib:
+    r"""
+    Stands in for the DWDataReaderLib. Files are given as a dictionary of filename: (sample_rate, channels), where each
+    channel is a dictionary with the name, unit, data_type, time, values and optionally array_size, scale and offset.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.channels = []
+
+    def _write(self, dst, values):
+        values = np.ascontiguousarray(values)
+        memmove(dst, values.ctypes.data, values.nbytes)
+
+    def _channel(self, idx):
+        return self.channels[getattr(idx, 'value', idx)]
+
+    def DWInit(self):
+        return 0
+
+    def DWDeInit(self):
+        return 0
+
+    def DWOpenDataFile(self, fname, finfo):
+        sample_rate, self.channels = self.files[fname.value.decode()]
+        finfo.sample_rate = sample_rate
+        finfo.start_store_time = 0.
+        finfo.duration = 1.
+        return 0
+
+    def DWCloseDataFile(self):
+        return 0
+
+    def DWGetChannelListCount(self):
+        return len(self.channels)
+
+    def DWGetChannelList(self, ch_list):
+        for i, chan in enumerate(self.channels):
+            target = ch_list._obj[i]
+            target.index = i
+            target.name = chan['name'].encode()
+            target.unit = chan.get('unit', '').encode()
+            target.array_size = chan.get('array_size', 1)
+            target.data_type = chan['data_type'].value
+        return 0
+
+    def DWGetChannelProps(self, idx, prop, p_buff, max_len):
+        chan = self._channel(idx)
+        prop = DWChannelProps(prop.value)
+        if prop == DWChannelProps.DW_DATA_TYPE:
+            cast(p_buff, POINTER(c_int))[0] = chan['data_type'].value
+        elif prop == DWChannelProps.DW_CH_TYPE:
+            cast(p_buff, POINTER(c_int))[0] = 0
+        elif prop == DWChannelProps.DW_DATA_TYPE_LEN_BYTES:
+            cast(p_buff, POINTER(c_int))[0] = chan.get('data_type_len', max(len(value) for value in chan['values']))
+        elif prop == DWChannelProps.DW_CH_SCALE:
+            cast(p_buff, POINTER(c_double))[0] = chan.get('scale', 1.)
+        elif prop == DWChannelProps.DW_CH_OFFSET:
+            cast(p_buff, POINTER(c_double))[0] = chan.get('offset', 0.)
+        return 0
+
+    def DWGetScaledSamplesCount(self, idx):
+        return len(self._channel(idx)['time'])
+
+    DWGetRawSamplesCount = DWGetScaledSamplesCount
+    DWGetBinarySamplesCount = DWGetScaledSamplesCount
+
+    def DWGetScaledSamples(self, idx, position, count, data, time_stamp):
+        chan = self._channel(idx)
+        self._write(data, np.asarray(chan['values'], dtype=np.float64) * chan.get('scale', 1.) + chan.get('offset', 0.))
+        self._write(time_stamp, np.asarray(chan['time'], dtype=np.float64))
+        return 0
+
+    def DWGetRawSamples(self, idx, position, count, data, time_stamp):
+        chan = self._channel(idx)
+        self._write(data, chan['values'])
+        self._write(time_stamp, np.asarray(chan['time'], dtype=np.float64))
+        return 0
+
+    def DWGetBinarySamplesEx(self, idx, position, count, data, time_stamp, data_len):
+        chan = self._channel(idx)
+        buff = b''.join(len(value).to_bytes(4, 'little') + value for value in chan['values'])
+        memmove(data, buff, min(len(buff), len(data)))
+        data_len._obj.value = len(buff)
+        self._write(time_stamp, np.asarray(chan['time'], dtype=np.float64))
+        return 0
+
+    def DWGetArrayInfoCount(self, idx):
+        return 1
+
+    def DWGetArrayInfoList(self, idx, info_list):
+        info = info_list._obj[0]
+        info.name = b'axis'
+        info.size = self._channel(idx).get('array_size', 1)
+        return 0
+
+
+def stub_reader(files, **kwargs):
+    with patch('platform.architecture', return_value=('64bit', 'WindowsPE')), \
+            patch('pyDewesoft.DataReader.cdll') as cdll:
+        cdll.LoadLibrary.return_value = StubLib(files)
+        return Reader(**kwargs)
+
+
 class TestReader(TestCase):
     def test_read(self):
         reader = Reader()
@@ -45,3 +154,215 @@ class TestReader(TestCase):
             np.testing.assert_array_equal(reader.data[channel][0], expected_result[channel][0])
             np.testing.assert_array_equal(reader.data[channel][1], expected_result[channel][1])
         del reader
+
+
+class TestScaledChannel(TestCase):
+    def test_lazy_scaling(self):
+        raw = np.array([-32768, 0, 1, 32767], dtype=np.int16)
+        chan = ScaledChannel(raw, scale=0.5, offset=2., units=u.V)
+        self.assertEqual(chan.nbytes, 8)
+        np.testing.assert_array_equal(chan.magnitude, raw * 0.5 + 2.)
+        self.assertEqual(chan[2], 2.5 * u.V)
+        np.testing.assert_array_equal(np.concatenate([c.magnitude for c in chan.chunks(3)]), chan.magnitude)
+        self.assertEqual(chan.raw.dtype, np.int16)
+
+    def test_append(self):
+        chan = ScaledChannel(np.arange(4, dtype=np.uint16), scale=2., units=u.m)
+        appended = chan.append(ScaledChannel(np.arange(2, dtype=np.uint16), scale=2., units=u.m))
+        self.assertIsInstance(appended, ScaledChannel)
+        self.assertEqual(appended.raw.dtype, np.uint16)
+        np.testing.assert_array_equal(appended.magnitude, [0., 2., 4., 6., 0., 2.])
+        rescaled = chan.append(ScaledChannel(np.arange(2, dtype=np.uint16), scale=1., units=u.m))
+        np.testing.assert_array_equal(rescaled.magnitude, [0., 2., 4., 6., 0., 1.])
+
+    def test_append_quantity(self):
+        chan = ScaledChannel(np.arange(3, dtype=np.float64), units=u.m)
+        appended = chan.append(np.array([3., 4.]) * u.m)
+        self.assertIsInstance(appended, ScaledChannel)
+        np.testing.assert_array_equal(appended.magnitude, np.arange(5))
+
+
+class TestData(TestCase):
+    def setUp(self):
+        self.data = Data()
+        self.data.sample_rate = 10.
+        self.data.ch_fast = np.arange(100.)
+        self.data.time['ch_fast'] = np.arange(100.) / 10.
+        self.data.ch_raw = ScaledChannel(np.arange(100, dtype=np.int16), scale=2., units=u.V)
+        self.data.time['ch_raw'] = np.arange(100.) / 10.
+        self.data.ch_slow = np.arange(10.) * u.m
+        self.data.time['ch_slow'] = np.arange(10.)
+        self.data.ch_single = np.array([42.])
+
+    def test_slice(self):
+        sliced = self.data.slice(2., 4. * u.s)
+        self.assertEqual(sliced.channel_names, self.data.channel_names)
+        time, values = sliced['ch_fast']
+        np.testing.assert_array_equal(time.m, np.arange(20., 40.) / 10.)
+        np.testing.assert_array_equal(values, np.arange(20., 40.))
+        self.assertTrue(np.shares_memory(values, self.data.ch_fast))
+        self.assertTrue(np.shares_memory(sliced.ch_raw.raw, self.data.ch_raw.raw))
+        np.testing.assert_array_equal(sliced['ch_slow'][1].m, [2., 3.])
+        self.assertIs(sliced.ch_single, self.data.ch_single)
+
+    def test_slice_channels(self):
+        sliced = self.data.slice(0., 1., channels=['ch_slow'])
+        self.assertEqual(sliced.channel_names[sliced.offset_channel_idx:], ['ch_slow'])
+        self.assertEqual(len(sliced.time), 1)
+        np.testing.assert_array_equal(sliced['ch_slow'][1].m, [0.])
+
+
+class TestTime(TestCase):
+    def setUp(self):
+        self.time = Time()
+        self.time['ch_a'] = np.arange(10.)
+
+    def test_overlap_length(self):
+        self.assertEqual(self.time.overlap_length('ch_a', np.arange(10., 15.)), 0)
+        self.assertEqual(self.time.overlap_length('ch_a', np.arange(7., 15.)), 3)
+        self.assertEqual(self.time.overlap_length('ch_a', np.arange(0., 5.)), 5)
+        self.assertEqual(self.time.overlap_length('ch_a', np.array([])), 0)
+
+    def test_filter_existing(self):
+        np.testing.assert_array_equal(self.time.filter_existing('ch_a', np.arange(8.5, 12.)), [1, 2, 3])
+
+    def test_main_time(self):
+        self.time['ch_b'] = np.arange(20.) / 10.
+        self.time.sample_rate = 10.
+        np.testing.assert_array_equal(self.time.magnitude('main'), np.arange(20.) / 10.)
+        self.time.main_time = None
+        self.time.sample_rate = 1000.
+        self.assertEqual(len(self.time.magnitude('main')), 20)
+
+
+class TestStubbedReader(TestCase):
+    def test_read_channel_types(self):
+        frames = np.zeros((3,), dtype=CAN_DTYPE)
+        frames['arb_id'] = [1, 2, 3]
+        files = {'a.dxd': (10., [
+            {'name': 'can', 'data_type': DWDataType.dtCANPortData, 'time': [0., 1., 2.], 'values': frames},
+            {'name': 'text', 'data_type': DWDataType.dtText, 'time': [0., 1.], 'values': [b'start', b'stop']},
+            {'name': 'array', 'data_type': DWDataType.dtDouble, 'array_size': 3, 'unit': 'V',
+             'time': np.arange(4.) / 10., 'values': np.arange(12.)},
+        ])}
+        reader = stub_reader(files)
+        reader.read('a.dxd')
+        np.testing.assert_array_equal(reader.data.ch_can['arb_id'], [1, 2, 3])
+        self.assertEqual(list(reader.data.ch_text), ['start', 'stop'])
+        self.assertEqual(reader.data.ch_array.shape, (4, 3))
+        self.assertIn('array axes', reader.data.ch_array.__doc__)
+
+    def test_binary_buffer_too_small(self):
+        files = {'a.dxd': (10., [{'name': 'text', 'data_type': DWDataType.dtText, 'time': [0., 1.],
+                                  'values': [b'start', b'stop'], 'data_type_len': 1}])}
+        reader = stub_reader(files)
+        with self.assertRaises(RuntimeError):
+            reader.read('a.dxd')
+
+    def test_sequence_read_array_channel(self):
+        files = {name: (10., [{'name': 'array', 'data_type': DWDataType.dtDouble, 'array_size': 3,
+                               'time': np.arange(10.) / 10. + start, 'values': np.arange(30.)}])
+                 for name, start in (('a.dxd', 0.), ('b.dxd', 1.))}
+        reader = stub_reader(files)
+        reader.sequence_read(['a.dxd', 'b.dxd'])
+        time, values = reader.data['ch_array']
+        self.assertEqual(np.shape(values), (20, 3))
+        self.assertEqual(len(time), 20)
+
+
+def gap_files(data_type, values, extra=()):
+    r"""Two files of 10 samples at 10 Hz with a gap of one second in between"""
+    return {name: (10., [{'name': 'chan', 'unit': 'V', 'data_type': data_type, 'time': np.arange(10.) / 10. + start,
+                          'values': values}] + list(extra))
+            for name, start in (('a.dxd', 0.), ('b.dxd', 2.))}
+
+
+class TestOutOfCoreReader(TestCase):
+    def read(self, files, memory_limit, raw=False):
+        reader = stub_reader(files, raw=raw)
+        reader.sequence_read(['a.dxd', 'b.dxd'], correcttime=True, memory_limit=memory_limit)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_memory_limit_gives_same_result(self):
+        files = gap_files(DWDataType.dtDouble, np.arange(10.))
+        in_memory = self.read(files, None)
+        spilled = self.read(files, 0)
+        for reader in (in_memory, spilled):
+            time, values = reader.data['ch_chan']
+            self.assertEqual(len(time), 31)
+            self.assertEqual(len(values), 31)
+            self.assertEqual(values.units, u.V)
+            self.assertEqual(np.isnan(values.magnitude).sum(), 11)
+        self.assertNotIsInstance(in_memory.data.ch_chan.magnitude, np.memmap)
+        self.assertIsInstance(spilled.data.ch_chan.magnitude, np.memmap)
+        self.assertIsInstance(spilled.data.time.magnitude('ch_chan'), np.memmap)
+        np.testing.assert_array_equal(in_memory.data['ch_chan'][0], spilled.data['ch_chan'][0])
+        np.testing.assert_array_equal(in_memory.data['ch_chan'][1], spilled.data['ch_chan'][1])
+
+    def test_integer_channel_is_filled(self):
+        files = gap_files(DWDataType.dtWord, np.arange(10, dtype=np.uint16))
+        for memory_limit in (None, 0):
+            reader = self.read(files, memory_limit, raw=True)
+            chan = reader.data.ch_chan
+            self.assertIsInstance(chan, ScaledChannel)
+            self.assertEqual(chan.raw.dtype, np.float64)
+            self.assertEqual(len(chan), len(reader.data.time['ch_chan']))
+            np.testing.assert_array_equal(chan.magnitude[:10], np.arange(10.))
+
+    def test_scratch_files_are_removed(self):
+        files = gap_files(DWDataType.dtDouble, np.arange(10.))
+        with TemporaryDirectory() as scratch_dir:
+            reader = stub_reader(files)
+            reader.sequence_read(['a.dxd', 'b.dxd'], correcttime=True, memory_limit=0, scratch_dir=scratch_dir)
+            used = {reader.data.ch_chan.magnitude.filename, reader.data.time.magnitude('ch_chan').filename}
+            self.assertEqual({path.join(scratch_dir, name) for name in listdir(scratch_dir)}, used)
+            reader.close()
+            self.assertEqual(listdir(scratch_dir), [])
+        reader = self.read(files, 0)
+        scratch_dir = reader.scratch_dir
+        reader.close()
+        self.assertFalse(path.exists(scratch_dir))
+
+    def test_overlapping_files(self):
+        files = {name: (10., [{'name': chan, 'unit': 'V', 'data_type': DWDataType.dtDouble,
+                               'time': np.arange(10.) / 10. + start, 'values': np.arange(10.) + start * 10.}
+                              for chan in ('a', 'b')])
+                 for name, start in (('a.dxd', 0.), ('b.dxd', .5))}
+        for memory_limit in (None, 0):
+            reader = stub_reader(files)
+            reader.sequence_read(['a.dxd', 'b.dxd'], memory_limit=memory_limit)
+            self.addCleanup(reader.close)
+            for chan in ('ch_a', 'ch_b'):
+                time = reader.data.time.magnitude(chan)
+                self.assertEqual(len(time), 15)
+                self.assertTrue((np.diff(time) > 0).all())
+                np.testing.assert_array_equal(getattr(reader.data, chan).magnitude, np.arange(15.))
+            self.assertIs(reader.data.time.magnitude('ch_a'), reader.data.time.magnitude('ch_b'))
+            self.assertEqual([name for name, _ in reader.overlaps], ['b.dxd'])
+            self.assertEqual(set(reader.overlaps[0][1]), {'ch_a', 'ch_b'})
+            cnt, first, last = reader.overlaps[0][1]['ch_a']
+            self.assertEqual(cnt, 5)
+            self.assertAlmostEqual(first, .5)
+            self.assertAlmostEqual(last, .9)
+            self.assertAlmostEqual(reader.data.duration, 1.5)
+
+    def test_restarted_recording(self):
+        files = gap_files(DWDataType.dtDouble, np.arange(10.))
+        files['c.dxd'] = files['a.dxd']
+        reader = stub_reader(files)
+        with self.assertWarns(RuntimeWarning):
+            reader.sequence_read(['a.dxd', 'b.dxd', 'c.dxd'])
+        self.assertEqual(len(reader.data.ch_chan), 20)
+        self.assertEqual(reader.overlaps[0][0], 'c.dxd')
+        self.assertEqual(reader.overlaps[0][1]['ch_chan'][0], 10)
+        self.assertAlmostEqual(reader.data.duration, 2.)
+
+    def test_can_on_main_time_line(self):
+        frames = np.zeros((10,), dtype=CAN_DTYPE)
+        can = {'name': 'can', 'data_type': DWDataType.dtCANPortData, 'values': frames}
+        files = gap_files(DWDataType.dtDouble, np.arange(10.))
+        for name, start in (('a.dxd', 0.), ('b.dxd', 2.)):
+            files[name][1].append(dict(can, time=np.arange(10.) / 10. + start))
+        with self.assertRaises(ValueError):
+            self.read(files, None)